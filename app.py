@@ -1,13 +1,17 @@
-from flask import Flask, render_template, request, send_file
-from datetime import datetime, timedelta
+from flask import Flask, abort, make_response, render_template, request, send_file
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import pytz
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import io
-import base64
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.patches import Circle
+import math
+import re
+import time
+import threading
+from cachetools import cached, LRUCache, TLRUCache, TTLCache
+from cachetools.keys import hashkey
 
 # ---------------- Flask App ----------------
 app = Flask(__name__)
@@ -15,14 +19,29 @@ app = Flask(__name__)
 # ---------------- Planner Settings ----------------
 OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY", "")
 LOCATION = "Pittsburgh, US"
+EASTERN = pytz.timezone("US/Eastern")
+UTC = pytz.utc
 LOG_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
 os.makedirs(LOG_FOLDER, exist_ok=True)
 RITUALS = ["LIRP", "RR", "LBRP", "LIRH", "MP", "GIRP", "GIRH", "RC"]
+WEATHER_URL = (f"http://api.openweathermap.org/data/2.5/weather"
+               f"?q={LOCATION}&appid={OPENWEATHER_API_KEY}&units=metric")
+WEATHER_TTL = 600  # seconds; keeps us well under the free-tier daily quota
+WEATHER_RETRY_TTL = 60  # seconds to show "unavailable" before retrying a failed fetch
+TIME_BUCKET = 900  # seconds; Eastern hour boundaries always fall on a bucket edge
 
 # ---------------- Planner Helper Functions ----------------
 
+def _time_bucket():
+    return int(time.time() // TIME_BUCKET)
+
 def get_elemental_quarter():
-    current_hour = datetime.now(pytz.timezone("US/Eastern")).hour
+    return _elemental_quarter_for(_time_bucket())
+
+# The result is a pure function of the bucket, so no TTL is needed.
+@lru_cache(maxsize=4)
+def _elemental_quarter_for(bucket):
+    current_hour = datetime.fromtimestamp(bucket * TIME_BUCKET, EASTERN).hour
     if 0 <= current_hour < 6:
         return "Earth (12 AM - 6 AM)"
     elif 6 <= current_hour < 12:
@@ -32,36 +51,48 @@ def get_elemental_quarter():
     else:
         return "Water (6 PM - 12 AM)"
 
+# Moon age in whole days (0-29) -> phase name, using the old fractional
+# thresholds evaluated at the middle of each day.
+MOON_PHASES = (("New Moon",) + ("Waxing Crescent",) * 6 + ("First Quarter",)
+               + ("Waxing Gibbous",) * 7 + ("Full Moon",)
+               + ("Waning Gibbous",) * 6 + ("Last Quarter",)
+               + ("Waning Crescent",) * 6 + ("New Moon",))
+LUNATION = 2953059  # mean synodic month in units of 1e-5 day
+MOON_REF_ORDINAL = date(2000, 1, 6).toordinal()  # new moon, 12:24 UTC
+MOON_REF_OFFSET = 19167  # sample each day at ~noon Eastern (17:00 UTC)
+
+@lru_cache(maxsize=8)
+def moon_age(y, m, d):
+    days = date(y, m, d).toordinal() - MOON_REF_ORDINAL
+    return (days * 100000 + MOON_REF_OFFSET) % LUNATION // 100000
+
 def get_moon_phase():
     try:
-        ref_date = datetime(2000, 1, 6, 12, 24, tzinfo=pytz.utc)
-        current_date = datetime.now(pytz.timezone("US/Eastern")).astimezone(pytz.utc)
-        days_since_ref = (current_date - ref_date).days + (current_date - ref_date).seconds / 86400.0
-        lunation = 29.53058867
-        phase = (days_since_ref % lunation) / lunation
-        if phase < 0.03 or phase > 0.97:
-            return "New Moon"
-        elif phase < 0.25:
-            return "Waxing Crescent"
-        elif phase < 0.27:
-            return "First Quarter"
-        elif phase < 0.50:
-            return "Waxing Gibbous"
-        elif phase < 0.53:
-            return "Full Moon"
-        elif phase < 0.75:
-            return "Waning Gibbous"
-        elif phase < 0.77:
-            return "Last Quarter"
-        else:
-            return "Waning Crescent"
+        today = datetime.now(EASTERN).date()
+        return MOON_PHASES[moon_age(today.year, today.month, today.day)]
     except Exception:
         return "Moon phase data unavailable"
 
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+def _weather_ttu(key, data, now):
+    # Failed or error responses expire quickly so an outage costs one
+    # attempt per minute rather than one (or two) per pageview.
+    return now + (WEATHER_TTL if "dt" in data else WEATHER_RETRY_TTL)
+
+@cached(TLRUCache(maxsize=1, ttu=_weather_ttu), lock=threading.RLock())
+def _fetch_weather_json():
+    # Shared by get_weather and get_sunrise_sunset so a pageview costs at most
+    # one API round-trip, and usually none.
+    try:
+        return _SESSION.get(WEATHER_URL, timeout=(2, 5)).json()
+    except Exception:
+        return {}
+
 def get_weather():
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={LOCATION}&appid={OPENWEATHER_API_KEY}&units=metric"
-        data = requests.get(url).json()
+        data = _fetch_weather_json()
         if "main" in data:
             temp_c = data["main"]["temp"]
             temp_f = (temp_c * 9 / 5) + 32
@@ -74,47 +105,52 @@ def get_weather():
 
 def get_sunrise_sunset():
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={LOCATION}&appid={OPENWEATHER_API_KEY}&units=metric"
-        data = requests.get(url).json()
+        data = _fetch_weather_json()
         if "sys" in data:
             timezone_offset = data["timezone"]
             sunrise = datetime.utcfromtimestamp(data["sys"]["sunrise"] + timezone_offset).replace(
-                tzinfo=pytz.utc).astimezone(pytz.timezone("US/Eastern"))
+                tzinfo=UTC).astimezone(EASTERN)
             sunset = datetime.utcfromtimestamp(data["sys"]["sunset"] + timezone_offset).replace(
-                tzinfo=pytz.utc).astimezone(pytz.timezone("US/Eastern"))
+                tzinfo=UTC).astimezone(EASTERN)
             return sunrise, sunset
         else:
             return None, None
     except Exception:
         return None, None
 
+PLANETS = ["Sun", "Venus", "Mercury", "Moon", "Saturn", "Jupiter", "Mars"]
+# Index into PLANETS of each day's first-hour ruler, by datetime.weekday().
+DAY_START_INDEX = tuple(PLANETS.index(planet) for planet in
+                        ["Moon", "Mars", "Mercury", "Jupiter", "Venus", "Saturn", "Sun"])
+
 def get_planetary_hour():
+    return _current_planetary_hour()
+
+# Planetary hours follow sunrise and sunset rather than the clock, so this is
+# just a short-lived cache of the current answer; the TTL bounds staleness.
+@cached(TTLCache(maxsize=1, ttl=60), lock=threading.RLock())
+def _current_planetary_hour():
     try:
         sunrise, sunset = get_sunrise_sunset()
         if not sunrise or not sunset:
             return "Planetary hour data unavailable"
-        planets = ["Sun", "Venus", "Mercury", "Moon", "Saturn", "Jupiter", "Mars"]
-        start_planet = {
-            "Sunday": "Sun", "Monday": "Moon", "Tuesday": "Mars",
-            "Wednesday": "Mercury", "Thursday": "Jupiter",
-            "Friday": "Venus", "Saturday": "Saturn"
-        }
-        day_of_week = datetime.now(pytz.timezone("US/Eastern")).strftime("%A")
-        day_start_planet = start_planet[day_of_week]
+        current_time = datetime.now(EASTERN)
+        start_index = DAY_START_INDEX[current_time.weekday()]
         daytime_duration = (sunset - sunrise) / 12
         nighttime_duration = (sunrise + timedelta(days=1) - sunset) / 12
-        current_time = datetime.now(pytz.timezone("US/Eastern"))
         if sunrise <= current_time < sunset:
             hours_since_sunrise = int((current_time - sunrise) / daytime_duration)
-            current_planet = planets[(planets.index(day_start_planet) + hours_since_sunrise) % 7]
+            current_planet = PLANETS[(start_index + hours_since_sunrise) % 7]
         else:
             hours_since_sunset = int((current_time - sunset) / nighttime_duration)
-            current_planet = planets[(planets.index(day_start_planet) + 12 + hours_since_sunset) % 7]
+            current_planet = PLANETS[(start_index + 12 + hours_since_sunset) % 7]
         return current_planet
     except Exception:
         return "Planetary hour data unavailable"
 
 # ---------------- Sigil Generator Setup ----------------
+# Rendered sigils are cached, so cap the word length to bound each entry.
+MAX_SIGIL_WORD = 64
 letter_mapping = {
     "A": [("A", "#FFFF00")], "E": [("A", "#FFFF00")], "B": [("B", "#FFFF00")],
     "C": [("G", "#0000FF")], "CH": [("Ch", "#FFD700")], "H": [("H", "#FF0000")],
@@ -130,44 +166,55 @@ letter_mapping = {
     "R": [("R", "#FFA500")], "RH": [("RH", "#FFD700")],
 }
 
+LETTER_INFO = {k: v[0] for k, v in letter_mapping.items()}
+# Longest alternatives first, so digrams like "CH" win over "C" followed by "H".
+TOKEN_RE = re.compile("|".join(sorted(letter_mapping, key=len, reverse=True)))
+
+ORDERED_OUTER_LETTERS = ["H","Z","V","E","Q","X","O","S","N","L","I","T","Ch"]
+ORDERED_MIDDLE_LETTERS = ["R","RH","P","PH","F","K","KH","TH","G","GH","D","DH","B"]
+ORDERED_MOTHER_LETTERS = ["M","A","Sh"]
+
+def _ring_positions(letters, radius):
+    step = 2 * math.pi / len(letters)
+    return {letter: (-math.cos(i * step) * radius, math.sin(i * step) * radius)
+            for i, letter in enumerate(letters)}
+
+# Letter positions on the rose never change, so lay them out once at import.
+ALL_POSITIONS = {}
+ALL_POSITIONS.update(_ring_positions(ORDERED_OUTER_LETTERS, 2))
+ALL_POSITIONS.update(_ring_positions(ORDERED_MIDDLE_LETTERS, 1.2))
+# Mother letters sit left, top and right of the centre, in list order.
+ALL_POSITIONS.update(zip(ORDERED_MOTHER_LETTERS, [(-0.7,0), (0,0.7), (0.7,0)]))
+
+# Each worker thread keeps one Figure and redraws into it, skipping pyplot's
+# global figure manager and a fresh canvas allocation on every sigil.
+_TLS = threading.local()
+
+# Matplotlib (and numpy with it) is imported lazily so planner-only workers
+# never pay for it; after the first sigil these imports are dict lookups.
+def _get_sigil_figure():
+    fig = getattr(_TLS, "fig", None)
+    if fig is None:
+        from matplotlib.backends.backend_svg import FigureCanvasSVG
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(6,6), facecolor='#D3D3D3')
+        FigureCanvasSVG(fig)
+        _TLS.fig = fig
+    fig.clear()
+    return fig
+
 def preprocess_word(word):
-    word = word.upper()
-    processed_word = []
-    skip_next = False
-    for i in range(len(word)):
-        if skip_next:
-            skip_next = False
-            continue
-        if i < len(word) - 1:
-            two_letter_combo = word[i] + word[i + 1]
-            if two_letter_combo in letter_mapping:
-                processed_word.append(two_letter_combo)
-                skip_next = True
-                continue
-        if word[i] in letter_mapping:
-            processed_word.append(word[i])
-    return processed_word
-
-def draw_rose_sigil(word="JAMES"):
+    return TOKEN_RE.findall(word.upper())
+
+@cached(LRUCache(maxsize=512), key=lambda word="JAMES": hashkey(word.upper()),
+        lock=threading.RLock())
+def _render_sigil_svg(word="JAMES"):
+    from matplotlib import rc_context
+    from matplotlib.patches import Circle
     word = preprocess_word(word)
-    all_positions = {}
-    ordered_outer_letters = ["H","Z","V","E","Q","X","O","S","N","L","I","T","Ch"]
-    ordered_middle_letters = ["R","RH","P","PH","F","K","KH","TH","G","GH","D","DH","B"]
-    ordered_mother_letters = ["M","A","Sh"]
-    all_positions.update({
-        letter: (-np.cos(i*(2*np.pi/len(ordered_outer_letters)))*2,
-                 np.sin(i*(2*np.pi/len(ordered_outer_letters)))*2)
-        for i, letter in enumerate(ordered_outer_letters)
-    })
-    all_positions.update({
-        letter: (-np.cos(i*(2*np.pi/len(ordered_middle_letters)))*1.2,
-                 np.sin(i*(2*np.pi/len(ordered_middle_letters)))*1.2)
-        for i, letter in enumerate(ordered_middle_letters)
-    })
-    all_positions["A"] = (0,0.7)
-    all_positions["M"] = (-0.7,0)
-    all_positions["Sh"] = (0.7,0)
-    fig, ax = plt.subplots(figsize=(6,6), facecolor='#D3D3D3')
+    all_positions = ALL_POSITIONS
+    fig = _get_sigil_figure()
+    ax = fig.add_subplot(111)
     ax.set_xlim(-3,3)
     ax.set_ylim(-3,3)
     ax.set_aspect('equal')
@@ -175,41 +222,58 @@ def draw_rose_sigil(word="JAMES"):
     prev_pos = prev_color = first_pos = last_pos = None
     seen_positions = {}
     for char in word:
-        if char in letter_mapping:
-            letter, color = letter_mapping[char][0]
-            if letter not in all_positions:
-                continue
-            x, y = all_positions[letter]
-            ax.text(x, y, letter, fontsize=16, ha='center', va='center',
-                    color=color, fontweight='bold')
-            if prev_pos:
-                ax.plot([prev_pos[0], x], [prev_pos[1], y], color=prev_color, lw=2)
-            if (x,y) in seen_positions:
-                ax.add_patch(Circle((x,y),0.2,fill=False, edgecolor=color,lw=2))
-            seen_positions[(x,y)] = True
-            if first_pos is None:
-                first_pos = (x,y)
-            last_pos = (x,y)
-            prev_pos = (x,y)
-            prev_color = color
+        letter, color = LETTER_INFO[char]
+        if letter not in all_positions:
+            continue
+        x, y = all_positions[letter]
+        ax.text(x, y, letter, fontsize=16, ha='center', va='center',
+                color=color, fontweight='bold')
+        if prev_pos:
+            ax.plot([prev_pos[0], x], [prev_pos[1], y], color=prev_color, lw=2)
+        if (x,y) in seen_positions:
+            ax.add_patch(Circle((x,y),0.2,fill=False, edgecolor=color,lw=2))
+        seen_positions[(x,y)] = True
+        if first_pos is None:
+            first_pos = (x,y)
+        last_pos = (x,y)
+        prev_pos = (x,y)
+        prev_color = color
     if first_pos:
         ax.add_patch(Circle(first_pos,0.2, fill=False, edgecolor='black', lw=3))
     if last_pos:
         ax.plot([last_pos[0], last_pos[0]+0.2], [last_pos[1], last_pos[1]-0.2], color='black', lw=3)
-    plt.axis('off')
-    plt.title("An Alchemelodic Sigil Generator", color="black")
+    ax.axis('off')
+    ax.set_title("An Alchemelodic Sigil Generator", color="black")
+    # For typical short words this is a handful of glyphs, circles and lines,
+    # so the SVG is smaller than a PNG and skips rasterization and zlib.
+    # It grows about 1 KB per token, which MAX_SIGIL_WORD keeps bounded.
+    # A fixed hash salt and no Date keep the bytes identical across workers.
     img = io.BytesIO()
-    plt.savefig(img, format='png', facecolor=fig.get_facecolor())
-    img.seek(0)
-    img_base64 = base64.b64encode(img.getvalue()).decode()
-    plt.close()
-    return img_base64
+    with rc_context({"svg.hashsalt": "sigil"}):
+        fig.canvas.print_svg(img, metadata={"Date": None})
+    return img.getvalue()
 
 # ---------------- Flask Routes ----------------
 
+def _planner_etag(minute):
+    # The page shows the time to the minute and the weather is identified by
+    # its observation timestamp, which every worker sees the same way. The
+    # planetary hour can still turn over mid-minute, so the tag is weak.
+    return f"{minute}-{_fetch_weather_json().get('dt', 0)}"
+
+def _planner_cache_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response.make_conditional(request)
+
 @app.route("/", methods=["GET","POST"])
 def planner():
-    current_time = datetime.now(pytz.timezone("US/Eastern"))
+    minute = int(time.time() // 60)
+    etag = _planner_etag(minute)
+    if request.method == "GET" and request.if_none_match.contains_weak(etag):
+        return _planner_cache_headers(make_response("", 304), etag)
+    current_time = datetime.now(EASTERN)
     formatted_date = current_time.strftime("%b. %d, %Y")
     formatted_time = current_time.strftime("%I:%M %p")
     day_of_week = current_time.strftime("%A")
@@ -224,40 +288,55 @@ def planner():
         tarot_notes = request.form.get("tarot", "")
         rituals_notes = {ritual: request.form.get(f"note_{ritual}", "") for ritual in RITUALS}
         completed_rituals = request.form.getlist("rituals")
-        log_text = f"Date: {formatted_date}\nTime: {formatted_time}\nDay: {day_of_week}\n"
-        log_text += f"Elemental Quarter: {elemental_quarter}\nMoon Phase: {moon_phase}\n"
-        log_text += f"Weather: {weather}\nPlanetary Hour: {planetary_hour}\n"
-        log_text += f"Physical Condition: {physical_condition}\nMeditation Notes: {meditation_notes}\n"
-        log_text += f"Tarot Notes: {tarot_notes}\nRituals:\n"
+        parts = [
+            f"Date: {formatted_date}\nTime: {formatted_time}\nDay: {day_of_week}\n",
+            f"Elemental Quarter: {elemental_quarter}\nMoon Phase: {moon_phase}\n",
+            f"Weather: {weather}\nPlanetary Hour: {planetary_hour}\n",
+            f"Physical Condition: {physical_condition}\nMeditation Notes: {meditation_notes}\n",
+            f"Tarot Notes: {tarot_notes}\nRituals:\n",
+        ]
         for ritual in RITUALS:
             status = "Performed" if ritual in completed_rituals else "Not Performed"
             notes = rituals_notes.get(ritual,"")
-            log_text += f"  {ritual}: {status}, Notes: {notes}\n"
+            parts.append(f"  {ritual}: {status}, Notes: {notes}\n")
+        log_text = "".join(parts)
         log_filename = os.path.join(LOG_FOLDER, f"log_{current_time.strftime('%Y-%m-%d_%I-%M-%S_%p')}.txt")
-        with open(log_filename, "w") as f:
-            f.write(log_text)
-        return send_file(io.BytesIO(log_text.encode("utf-8")),
+        log_bytes = log_text.encode("utf-8")
+        with open(log_filename, "wb") as f:
+            f.write(log_bytes)
+        return send_file(io.BytesIO(log_bytes),
                          as_attachment=True,
                          download_name=os.path.basename(log_filename),
                          mimetype="text/plain")
-    return render_template("planner.html",
-                           formatted_date=formatted_date,
-                           formatted_time=formatted_time,
-                           day_of_week=day_of_week,
-                           elemental_quarter=elemental_quarter,
-                           moon_phase=moon_phase,
-                           weather=weather,
-                           planetary_hour=planetary_hour,
-                           rituals=RITUALS)
+    response = make_response(render_template("planner.html",
+                                             formatted_date=formatted_date,
+                                             formatted_time=formatted_time,
+                                             day_of_week=day_of_week,
+                                             elemental_quarter=elemental_quarter,
+                                             moon_phase=moon_phase,
+                                             weather=weather,
+                                             planetary_hour=planetary_hour,
+                                             rituals=RITUALS))
+    return _planner_cache_headers(response, etag)
 
 @app.route("/sigils", methods=["GET","POST"])
 def sigils():
-    sigil_image = None
+    sigil_word = None
     if request.method == "POST":
-        word = request.form.get("word","").strip()
-        if word:
-            sigil_image = draw_rose_sigil(word)
-    return render_template("sigils.html", sigil_image=sigil_image)
+        sigil_word = request.form.get("word","").strip() or None
+        if sigil_word and len(sigil_word) > MAX_SIGIL_WORD:
+            abort(400)
+    return render_template("sigils.html", sigil_word=sigil_word,
+                           max_word=MAX_SIGIL_WORD)
+
+@app.route("/sigil.svg")
+def sigil_svg():
+    word = request.args.get("word","").strip()
+    if not word or len(word) > MAX_SIGIL_WORD:
+        abort(400)
+    return send_file(io.BytesIO(_render_sigil_svg(word)),
+                     mimetype="image/svg+xml",
+                     max_age=86400)
 
 # ---------------- Run App ----------------
 if __name__ == "__main__":